@@ -1,13 +1,22 @@
+import asyncio
+import functools
+import hashlib
 import os
-import re
-from typing import List, Literal, Tuple
-from pydantic import BaseModel, Field
+import shelve
+import time
+from collections import OrderedDict
+from typing import Dict, List, Literal, Tuple
+from pydantic import BaseModel, Field, ValidationError
 from google import genai
 from google.genai import types
+from google.genai.errors import APIError, ClientError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 from textatistic import Textatistic
 
-from prompts import SYSTEM_RULES, ASL_HINTS, build_user_instructions
-from wordBank import LEVELS, WORD_BANK, LEVEL_POLICY, LevelEnum
+from prompts import SYSTEM_INSTRUCTION, STATIC_PREFIXES, BASE_PROMPTS, build_topic_suffix
+from wordBank import LEVELS, LEVEL_POLICY, MODEL_LADDER, LevelEnum
+from validation import count_story_tokens, check_story_text, out_of_bank_words
+from semantic_cache import EMBED_MODEL, CachedResult, SemanticCache
 
 class StoryPlan(BaseModel):
     level: LevelEnum = Field(..., description="Difficulty level A–H")
@@ -15,57 +24,20 @@ class StoryPlan(BaseModel):
     story_text: str = Field(..., description="Short story text in ASL style using only words from the allowed bank")
     sentences: List[str] | None = None
 
-# Tokenization and sentence helpers
-TOKEN_RE = re.compile(r"[A-Za-z']+")
-
-def normalize_word(w: str) -> str:
-    return w.lower()
-
-def tokenize_text(text: str) -> List[str]:
-    return [normalize_word(m.group(0)) for m in TOKEN_RE.finditer(text)]
-
-def split_sentences(text: str) -> List[str]:
-    parts = re.split(r"[.!?]+\s*", text.strip())
-    return [p for p in parts if p]
+# Built once; every uncached request reuses the same config and schema
+_GEN_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=StoryPlan,
+)
 
 def validate_story(plan: StoryPlan) -> Tuple[bool, List[str], StoryPlan]:
-    errors: List[str] = []
-    level = plan.level
-    allowed = WORD_BANK[level]
-
-    for w in plan.used_words:
-        if normalize_word(w) not in allowed:
-            errors.append(f"Out-of-bank used_words item: {w}")
-
-    # tokens must all be in bank
-    toks = tokenize_text(plan.story_text)
-    for t in toks:
-        if t not in allowed:
-            errors.append(f"OOV token in story_text: {t}")
-
-    # Difficulty caps
-    policy = LEVEL_POLICY[level]
-    if len(toks) > policy["max_tokens"]:
-        errors.append(f"Too many tokens: {len(toks)} > {policy['max_tokens']}")
-    sents = split_sentences(plan.story_text)
-    if len(sents) > policy["max_sentences"]:
-        errors.append(f"Too many sentences: {len(sents)} > {policy['max_sentences']}")
-
-    # Ensure used_words reflects unique tokens in first-appearance order
-    uniq = []
-    seen = set()
-    for t in toks:
-        if t not in seen:
-            uniq.append(t)
-            seen.add(t)
-    if [normalize_word(w) for w in plan.used_words] != uniq:
-        errors.append("used_words does not match unique token order from story_text")
+    errors, sents = check_story_text(plan.level, plan.story_text, tuple(plan.used_words))
 
     # Populate sentences if missing
     if not plan.sentences:
-        plan.sentences = sents
+        plan.sentences = list(sents)
 
-    return (len(errors) == 0, errors, plan)
+    return (len(errors) == 0, list(errors), plan)
 
 _client: genai.Client | None = None
 
@@ -78,53 +50,413 @@ def get_client() -> genai.Client:
         _client = genai.Client(api_key=api_key)
     return _client
 
-# output + retry loop
-def generate_story(topic: str, level: str, max_retries: int = 3, model: str = "gemini-2.0-flash") -> Tuple[StoryPlan, int]:
+# Context caches holding the static SYSTEM_RULES + ASL_HINTS + word bank prefix.
+# Caches are bound to a model, so entries are keyed by (model, level). A name of
+# None means the prefix is not cached and is sent inline instead.
+CACHE_TTL_SECONDS = 3600
+_CACHE: Dict[Tuple[str, str], Tuple[str | None, float]] = {}
+
+# Explicit caching rejects content below a per-model minimum; 1024 tokens is the
+# smallest minimum of any Gemini model. Tokens are estimated at ~4 chars each.
+CACHE_MIN_TOKENS = 1024
+CACHE_CHARS_PER_TOKEN = 4
+
+def _prefix_cacheable(level: str) -> bool:
+    size = len(SYSTEM_INSTRUCTION) + len(STATIC_PREFIXES[level])
+    return size // CACHE_CHARS_PER_TOKEN >= CACHE_MIN_TOKENS
+
+# Levels whose prefix is large enough to cache. The shipped banks are all well
+# below the minimum, so this is empty and no cache round-trip is ever made.
+_CACHEABLE_LEVELS = frozenset(level for level in LEVELS if _prefix_cacheable(level))
+
+def get_cached_prefix(client: genai.Client, model: str, level: str) -> str | None:
+    if level not in _CACHEABLE_LEVELS:
+        return None
+
+    key = (model, level)
+    entry = _CACHE.get(key)
+    # Refresh a minute early so in-flight retries never reference an expired cache
+    if entry is not None and time.monotonic() < entry[1] - 60:
+        return entry[0]
+
+    try:
+        cached = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=SYSTEM_INSTRUCTION,
+                contents=[STATIC_PREFIXES[level]],
+                ttl=f"{CACHE_TTL_SECONDS}s",
+            ),
+        )
+        name = cached.name
+    except APIError:
+        name = None
+
+    _CACHE[key] = (name, time.monotonic() + CACHE_TTL_SECONDS)
+    return name
+
+def check_level(level: str) -> None:
     if level not in LEVELS:
         raise ValueError("Invalid level; must be A–H")
 
-    allowed = WORD_BANK[level]
-    base_prompt = SYSTEM_RULES + "\n" + ASL_HINTS + "\n\n" + build_user_instructions(topic, level, allowed)
+def resolve_models(level: str, model: str | None) -> Tuple[str, ...]:
+    # An explicit model pins a single rung; otherwise walk the level's cascade
+    return (model,) if model else tuple(MODEL_LADDER[level])
+
+# Exact-match response cache keyed by (normalized topic, level, model cascade, retries).
+# Set STORY_CACHE_PATH to also persist results on disk across runs.
+STORY_CACHE_PATH = os.getenv("STORY_CACHE_PATH")
+STORY_CACHE_SIZE = 512
+_STORY_CACHE: "OrderedDict[Tuple[str, str, Tuple[str, ...], int], CachedResult]" = OrderedDict()
+
+_SEMANTIC_CACHE = SemanticCache()
+
+def normalize_topic(topic: str) -> str:
+    return " ".join(topic.lower().split())
+
+def generate_story(topic: str, level: str, max_retries: int = 3, model: str | None = None) -> Tuple[StoryPlan, Dict[str, int]]:
+    check_level(level)
+
+    plan_json, attempts = _generate_story_cached(topic, level, resolve_models(level, model), max_retries)
+    return StoryPlan.model_validate_json(plan_json), dict(attempts)
+
+def _still_valid(plan_json: str) -> bool:
+    try:
+        plan = StoryPlan.model_validate_json(plan_json)
+    except ValidationError:
+        return False
+    return validate_story(plan)[0]
 
-    config = types.GenerateContentConfig(
-        response_mime_type="application/json",
-        response_schema=StoryPlan,
+def _generate_story_cached(topic: str, level: str, models: Tuple[str, ...], max_retries: int) -> CachedResult:
+    # Only the cache key is normalized; generation sees the topic as the caller wrote it.
+    # The plan is cached serialized so callers always get a fresh, mutable StoryPlan.
+    topic_norm = normalize_topic(topic)
+    key = (topic_norm, level, models, max_retries)
+    result = _STORY_CACHE.get(key)
+    if result is not None:
+        _STORY_CACHE.move_to_end(key)
+        return result
+
+    if STORY_CACHE_PATH:
+        disk_key = hashlib.sha256(f"{level}|{topic_norm}|{','.join(models)}|{max_retries}".encode()).hexdigest()
+        with shelve.open(STORY_CACHE_PATH) as db:
+            result = db.get(disk_key)
+        # Disk entries outlive edits to the word bank and level caps, so a stored
+        # plan that no longer validates is treated as a miss
+        if result is not None and not _still_valid(result[0]):
+            result = None
+
+    if result is None:
+        # Near-duplicate topics ("dog at park" vs "a dog at the park") reuse a prior
+        # plan, but only one generated with the same model cascade and retry budget
+        client = get_client()
+        semantic_key = (level, models, max_retries)
+        # The semantic cache is optional: if embedding fails, just generate
+        try:
+            embedding = client.models.embed_content(model=EMBED_MODEL, contents=topic_norm).embeddings[0].values
+        except APIError:
+            embedding = None
+        if embedding is not None:
+            result = _SEMANTIC_CACHE.lookup(semantic_key, embedding)
+        if result is None:
+            plan, attempts = _generate_story_uncached(topic, level, max_retries, models)
+            result = (plan.model_dump_json(), tuple(attempts.items()))
+            if embedding is not None:
+                _SEMANTIC_CACHE.add(semantic_key, embedding, topic_norm, result)
+
+        if STORY_CACHE_PATH:
+            with shelve.open(STORY_CACHE_PATH) as db:
+                db[disk_key] = result
+
+    _STORY_CACHE[key] = result
+    if len(_STORY_CACHE) > STORY_CACHE_SIZE:
+        _STORY_CACHE.popitem(last=False)
+    return result
+
+@functools.lru_cache(maxsize=64)
+def _cached_config(cache_name: str) -> types.GenerateContentConfig:
+    return _GEN_CONFIG.model_copy(update={"cached_content": cache_name})
+
+def _build_request(cache_name: str | None, level: str) -> Tuple[str, types.GenerateContentConfig]:
+    # Reference the cached static prefix so only the topic/tighten tail is sent;
+    # otherwise send the prefix inline. Either way the static part leads and the
+    # topic trails, so implicit prefix caching can still hit across calls.
+    if cache_name:
+        return "", _cached_config(cache_name)
+    return BASE_PROMPTS[level], _GEN_CONFIG
+
+def _check_response(text: str, tighten_msgs: List[str]) -> Tuple[StoryPlan | None, List[str]]:
+    # Returns the plan when it passes validation; otherwise records a tighten message.
+    # Parses the raw text because batch responses never get .parsed filled in.
+    try:
+        plan = StoryPlan.model_validate_json(text)
+    except ValidationError:
+        tighten_msgs.append("Previous output violated the JSON schema. Return strict JSON only matching fields: level, used_words, story_text.")
+        return None, ["Schema parse error: returned output was not valid JSON per schema"]
+
+    ok, errors, plan = validate_story(plan)
+    if ok:
+        storyScore = Textatistic(plan.story_text).dalechall_score
+        print(f'Story Score: {storyScore}')
+        return plan, []
+
+    tighten_msgs.append(
+        "Previous output violated constraints:\n- "
+        + "\n- ".join(errors)
+        + "\nRegenerate strictly: use ONLY allowed words; stay under token/sentence caps; keep ASL style."
     )
+    return None, errors
 
-    attempt = 0
+def _record_overflow(level: str, tighten_msgs: List[str]) -> List[str]:
+    max_tokens = LEVEL_POLICY[level]["max_tokens"]
+    tighten_msgs.append(
+        f"Previous output exceeded the {max_tokens}-token cap and was cut off. "
+        f"Regenerate strictly: a shorter story of at most {max_tokens} tokens, using ONLY allowed words."
+    )
+    return [f"Too many tokens: > {max_tokens} (stream aborted)"]
+
+def _assess(text: str, complete: bool, level: str, tighten_msgs: List[str]) -> Tuple[StoryPlan | None, List[str]]:
+    if not complete:
+        return None, _record_overflow(level, tighten_msgs)
+    return _check_response(text, tighten_msgs)
+
+def _opening_suffix(topic: str, level: str) -> str:
+    # Out-of-bank topic words almost always leak into the story, so ask for a
+    # paraphrase up front instead of spending a retry on it
+    oov = out_of_bank_words(level, topic)
+    hints = [f"The topic contains words not in the bank ({', '.join(oov)}). Paraphrase the topic using only allowed words."] if oov else []
+    return build_topic_suffix(topic, hints)
+
+def _turn(role: str, text: str) -> types.Content:
+    return types.Content(role=role, parts=[types.Part.from_text(text=text)])
+
+def _retry_turns(text: str, tighten_msgs: List[str]) -> List[types.Content]:
+    # Retries extend the conversation with the rejected reply and the latest
+    # correction, so the opening turn stays an identical, cacheable prefix
+    turns = [_turn("model", text)] if text else []
+    turns.append(_turn("user", tighten_msgs[-1]))
+    return turns
+
+def _stream_story(client: genai.Client, model: str, contents: List[types.Content], config: types.GenerateContentConfig, max_tokens: int) -> Tuple[str, bool]:
+    # Returns the response text and whether it completed; the stream is cut
+    # short once story_text runs past the token cap
+    buf = ""
+    stream = client.models.generate_content_stream(
+        model=model,
+        contents=contents,
+        config=config,
+    )
+    for chunk in stream:
+        buf += chunk.text or ""
+        if count_story_tokens(buf) > max_tokens:
+            stream.close()
+            return buf, False
+    return buf, True
+
+# output + retry loop, escalating through the model cascade.
+# Attempts are counted per model; the correction history carries over when escalating.
+def _generate_story_uncached(topic: str, level: str, max_retries: int, models: Tuple[str, ...]) -> Tuple[StoryPlan, Dict[str, int]]:
+    attempts: Dict[str, int] = {}
     tighten_msgs: List[str] = []
     last_errors: List[str] = []
+    history: List[types.Content] = []
 
     client = get_client()
 
-    while attempt < max_retries:
-        attempt += 1
-        prompt = base_prompt if not tighten_msgs else base_prompt + "\n\n" + "\n".join(tighten_msgs)
+    for model in models:
+        base_prompt, config = _build_request(get_cached_prefix(client, model, level), level)
+        opening = _turn("user", base_prompt + _opening_suffix(topic, level))
+        attempts[model] = 0
 
-        response = client.models.generate_content(
-            model=model,
-            contents=prompt,
-            config=config,
-        )
+        while attempts[model] < max_retries:
+            attempts[model] += 1
+            text, complete = _stream_story(client, model, [opening, *history], config, LEVEL_POLICY[level]["max_tokens"])
+            plan, last_errors = _assess(text, complete, level, tighten_msgs)
+            if plan is not None:
+                return plan, attempts
+
+            history += _retry_turns(text, tighten_msgs)
+
+    raise RuntimeError("Failed to generate a valid story after retries: " + "; ".join(last_errors))
+
+def _is_rate_limited(exc: BaseException) -> bool:
+    return isinstance(exc, ClientError) and exc.code == 429
+
+# Back off exponentially when Gemini answers 429 (requests per minute exhausted)
+@retry(
+    retry=retry_if_exception(_is_rate_limited),
+    wait=wait_exponential(multiplier=1, max=60),
+    stop=stop_after_attempt(6),
+    reraise=True,
+)
+async def _stream_story_async(client: genai.Client, model: str, contents: List[types.Content], config: types.GenerateContentConfig, max_tokens: int) -> Tuple[str, bool]:
+    buf = ""
+    stream = await client.aio.models.generate_content_stream(
+        model=model,
+        contents=contents,
+        config=config,
+    )
+    async for chunk in stream:
+        buf += chunk.text or ""
+        if count_story_tokens(buf) > max_tokens:
+            await stream.aclose()
+            return buf, False
+    return buf, True
+
+# Speculative attempts race one request per temperature and keep the first valid plan
+SPECULATIVE_TEMPERATURES = (0.7, 1.0)
+
+async def _speculate(client: genai.Client, model: str, contents: List[types.Content], config: types.GenerateContentConfig, level: str, tighten_msgs: List[str]) -> Tuple[str, StoryPlan | None, List[str]]:
+    max_tokens = LEVEL_POLICY[level]["max_tokens"]
+    tasks = [
+        asyncio.create_task(_stream_story_async(client, model, contents, config.model_copy(update={"temperature": t}), max_tokens))
+        for t in SPECULATIVE_TEMPERATURES
+    ]
+    # If nothing passes, the first candidate to finish drives the correction turn
+    first_failure: Tuple[str, List[str], List[str]] | None = None
+    candidate_errors: List[Exception] = []
+    try:
+        for fut in asyncio.as_completed(tasks):
+            # One candidate erroring must not sink the attempt while another may still pass
+            try:
+                text, complete = await fut
+            except Exception as exc:
+                candidate_errors.append(exc)
+                continue
+            msgs: List[str] = []
+            plan, errors = _assess(text, complete, level, msgs)
+            if plan is not None:
+                return text, plan, []
+            if first_failure is None:
+                first_failure = (text, errors, msgs)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    # Only when every candidate errored is there nothing to retry from
+    if first_failure is None:
+        raise candidate_errors[0]
+
+    text, errors, msgs = first_failure
+    tighten_msgs += msgs
+    return text, None, errors
+
+# Async variant of the retry loop, for fanning out many topics concurrently.
+# Unlike generate_story it does not consult the response caches. With
+# speculative=True each attempt costs one request per SPECULATIVE_TEMPERATURES
+# entry in exchange for lower tail latency.
+async def generate_story_async(topic: str, level: str, max_retries: int = 3, model: str | None = None, speculative: bool = False) -> Tuple[StoryPlan, Dict[str, int]]:
+    check_level(level)
+
+    attempts: Dict[str, int] = {}
+    tighten_msgs: List[str] = []
+    last_errors: List[str] = []
+    history: List[types.Content] = []
+
+    client = get_client()
+
+    for rung in resolve_models(level, model):
+        # Only cacheable prefixes are worth the blocking caches round-trip
+        cache_name = await asyncio.to_thread(get_cached_prefix, client, rung, level) if level in _CACHEABLE_LEVELS else None
+        base_prompt, config = _build_request(cache_name, level)
+        opening = _turn("user", base_prompt + _opening_suffix(topic, level))
+        attempts[rung] = 0
+
+        while attempts[rung] < max_retries:
+            attempts[rung] += 1
+            contents = [opening, *history]
+            if speculative:
+                text, plan, last_errors = await _speculate(client, rung, contents, config, level, tighten_msgs)
+            else:
+                text, complete = await _stream_story_async(client, rung, contents, config, LEVEL_POLICY[level]["max_tokens"])
+                plan, last_errors = _assess(text, complete, level, tighten_msgs)
+            if plan is not None:
+                return plan, attempts
 
+            history += _retry_turns(text, tighten_msgs)
+
+    raise RuntimeError("Failed to generate a valid story after retries: " + "; ".join(last_errors))
+
+# Results line up with topics; a topic that fails holds its exception instead of a
+# plan, so one unsatisfiable topic does not discard the rest of the fan-out.
+async def generate_stories(topics: List[Tuple[str, str]], max_concurrency: int = 20, model: str | None = None, speculative: bool = False) -> List[StoryPlan | BaseException]:
+    client = get_client()
+    # Create the first-rung prefix caches up front so concurrent tasks don't race to create duplicates
+    cacheable = sorted({level for _, level in topics if level in _CACHEABLE_LEVELS})
+    if cacheable:
+        await asyncio.gather(*(asyncio.to_thread(get_cached_prefix, client, resolve_models(level, model)[0], level) for level in cacheable))
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(topic: str, level: str) -> StoryPlan:
+        async with semaphore:
+            plan, _ = await generate_story_async(topic, level, model=model, speculative=speculative)
+            return plan
+
+    return await asyncio.gather(*(run(topic, level) for topic, level in topics), return_exceptions=True)
+
+# Below this many topics the batch job overhead outweighs concurrent requests
+BATCH_MIN_SIZE = 8
+BATCH_POLL_SECONDS = 30
+BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+# Like generate_stories, each result is a StoryPlan or the exception for that topic
+def generate_stories_batch(topics_levels: List[Tuple[str, str]], model: str | None = None, poll_seconds: float = BATCH_POLL_SECONDS) -> List[StoryPlan | BaseException]:
+    for _, level in topics_levels:
+        check_level(level)
+
+    if len(topics_levels) < BATCH_MIN_SIZE:
+        return asyncio.run(generate_stories(topics_levels, model=model))
+
+    client = get_client()
+
+    # A batch job targets a single model, so group topics by their first cascade rung
+    groups: Dict[str, List[int]] = {}
+    for i, (_, level) in enumerate(topics_levels):
+        groups.setdefault(resolve_models(level, model)[0], []).append(i)
+
+    # One batch job per model carries all its prompts; results come back in submission order
+    plans: Dict[int, StoryPlan | BaseException] = {}
+    retry_idx: List[int] = []
+    jobs = []
+    for batch_model, idxs in groups.items():
         try:
-            plan: StoryPlan = response.parsed
-        except Exception:
-            last_errors = ["Schema parse error: returned output was not valid JSON per schema"]
-            tighten_msgs.append("Previous output violated the JSON schema. Return strict JSON only matching fields: level, used_words, story_text.")
+            job = client.batches.create(
+                model=batch_model,
+                src=[
+                    types.InlinedRequest(contents=BASE_PROMPTS[level] + _opening_suffix(topic, level), config=_GEN_CONFIG)
+                    for topic, level in (topics_levels[i] for i in idxs)
+                ],
+            )
+        except APIError:
+            retry_idx.extend(idxs)
             continue
+        jobs.append((job, idxs))
 
-        ok, errors, plan = validate_story(plan)
-        if ok:
-            storyScore = Textatistic(plan.story_text).dalechall_score
-            print(f'Story Score: {storyScore}')
-            return plan, attempt
-
-        last_errors = errors
-        tighten_msgs.append(
-            "Previous output violated constraints:\n- "
-            + "\n- ".join(errors)
-            + "\nRegenerate strictly: use ONLY allowed words; stay under token/sentence caps; keep ASL style."
-        )
+    for job, idxs in jobs:
+        while job.state.name not in BATCH_DONE_STATES:
+            time.sleep(poll_seconds)
+            job = client.batches.get(name=job.name)
 
-    raise RuntimeError("Failed to generate a valid story after retries: " + "; ".join(last_errors))
+        # A failed job only costs its own topics a retry; other jobs' results are kept.
+        # A missing or short response list leaves topics without a result, and those
+        # go to the retry path like errored items.
+        responses = (job.dest.inlined_responses if job.state.name == "JOB_STATE_SUCCEEDED" and job.dest else None) or []
+        retry_idx.extend(idxs[len(responses):])
+        for i, inlined in zip(idxs, responses):
+            # Errored items and empty responses skip straight to the retry path
+            text = inlined.response.text if inlined.response is not None else None
+            plan = _check_response(text, [])[0] if text else None
+            if plan is None:
+                retry_idx.append(i)
+            else:
+                plans[i] = plan
+
+    # Stories that errored or failed validation go through the regular retry loop;
+    # any that still fail keep their exception in place of a plan
+    if retry_idx:
+        retried = asyncio.run(generate_stories([topics_levels[i] for i in retry_idx], model=model))
+        for i, retried_result in zip(retry_idx, retried):
+            plans[i] = retried_result
+
+    return [plans[i] for i in range(len(topics_levels))]
@@ -1,6 +1,4 @@
-import json
-
-from wordBank import LEVELS, WORD_BANK
+from wordBank import LEVELS
 from generator import generate_story
 
 def main():
@@ -15,7 +13,7 @@ def main():
         exit(0)
 
     plan, attempts = generate_story(topic, level)
-    print(json.dumps(plan.model_dump(), indent=2))
+    print(plan.model_dump_json(indent=2))
     print(f"Attempts: {attempts}")
 
 if __name__ == "__main__":
@@ -1,4 +1,6 @@
-from typing import Set
+from typing import Dict, List
+
+from wordBank import LEVELS, SORTED_BULLETS
 
 SYSTEM_RULES = """You generate short stories in ASL-style grammar.
 Constraints:
@@ -11,10 +13,8 @@ Output JSON only, matching the schema.
 
 ASL_HINTS = "ASL style: TOPIC first if present; TIME marker early; minimal function words; simple clauses."
 
-def build_user_instructions(topic: str, level: str, allowed_words: Set[str]) -> str:
-    bullets = "\n".join(sorted(allowed_words))
-    user_instructions = f'''
-    Task: Write a short ASL-style story about: "{topic}".
+def build_static_prefix(level: str, bullets: str) -> str:
+    static_prefix = f'''
     Difficulty level: {level}
     Allowed word bank (lowercase only; use ONLY these words):
     {bullets}
@@ -27,4 +27,19 @@ def build_user_instructions(topic: str, level: str, allowed_words: Set[str]) ->
     Keep within difficulty caps and keep it engaging and clear.
     '''
 
-    return user_instructions
\ No newline at end of file
+    return static_prefix
+
+def build_topic_suffix(topic: str, tighten_msgs: List[str]) -> str:
+    topic_suffix = f'''
+    Task: Write a short ASL-style story about: "{topic}".
+    '''
+
+    if tighten_msgs:
+        topic_suffix += "\n\n" + "\n".join(tighten_msgs)
+
+    return topic_suffix
+
+# Static per-level prompt prefixes, precomputed at import
+SYSTEM_INSTRUCTION = SYSTEM_RULES + "\n" + ASL_HINTS
+STATIC_PREFIXES: Dict[str, str] = {lvl: build_static_prefix(lvl, SORTED_BULLETS[lvl]) for lvl in LEVELS}
+BASE_PROMPTS: Dict[str, str] = {lvl: SYSTEM_INSTRUCTION + "\n\n" + STATIC_PREFIXES[lvl] for lvl in LEVELS}
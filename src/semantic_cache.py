@@ -0,0 +1,45 @@
+import math
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+EMBED_MODEL = "text-embedding-004"
+SIMILARITY_THRESHOLD = 0.92
+
+# (plan JSON, ((model, attempts), ...)) as produced by the generator
+CachedResult = Tuple[str, Tuple[Tuple[str, int], ...]]
+
+def _unit(vec: Sequence[float]) -> List[float]:
+    norm = math.sqrt(math.sumprod(vec, vec))
+    return [x / norm for x in vec] if norm else list(vec)
+
+class SemanticCache:
+    """Returns a stored result when a new topic embedding is close to a cached one."""
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # Per-key unit vectors with a parallel list of (topic, result) entries.
+        # Keys partition the cache, e.g. by level and generation settings.
+        self._vectors: Dict[Hashable, List[List[float]]] = {}
+        self._entries: Dict[Hashable, List[Tuple[str, CachedResult]]] = {}
+
+    def lookup(self, key: Hashable, embedding: Sequence[float]) -> CachedResult | None:
+        # Vectors are stored normalized, so the dot product is the cosine similarity
+        q = _unit(embedding)
+        best_cos = self.threshold
+        best = None
+        for vec, (_, result) in zip(self._vectors.get(key, []), self._entries.get(key, [])):
+            cos = math.sumprod(vec, q)
+            if cos >= best_cos:
+                best_cos = cos
+                best = result
+        return best
+
+    def add(self, key: Hashable, embedding: Sequence[float], topic: str, result: CachedResult) -> None:
+        vectors = self._vectors.setdefault(key, [])
+        entries = self._entries.setdefault(key, [])
+        vectors.append(_unit(embedding))
+        entries.append((topic, result))
+        # Drop the oldest entries once the key is full
+        if len(vectors) > self.max_entries:
+            del vectors[0]
+            del entries[0]
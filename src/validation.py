@@ -0,0 +1,94 @@
+# Pure tokenization and validation helpers with no pydantic or API dependency,
+# so this module can be compiled with mypyc (see README). A compiled
+# validation*.so next to this file is picked up by the import system ahead of
+# the .py source; without it the pure-Python version is used.
+import functools
+import re
+import string
+from typing import List, Set, Tuple
+
+from wordBank import WORD_BIT, ALLOWED_MASK, LEVEL_POLICY
+
+# Tokenization and sentence helpers
+TOKEN_RE = re.compile(r"[A-Za-z']+")
+# Maps every ASCII character that TOKEN_RE would not match to a space
+_NON_TOKEN = str.maketrans({c: " " for c in map(chr, range(128)) if c not in string.ascii_letters + "'"})
+_SENT_RE = re.compile(r"[.!?]+\s*")
+# The (possibly still unterminated) story_text value inside a streamed JSON response
+_STORY_TEXT_RE = re.compile(r'"story_text"\s*:\s*"((?:[^"\\]|\\.)*)')
+# A JSON string escape; a \u escape cut off at the end of a chunk matches neither group
+_JSON_ESCAPE_RE = re.compile(r"\\(?:u([0-9a-fA-F]{4})|u[0-9a-fA-F]{0,3}$|(.))")
+_JSON_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+def normalize_word(w: str) -> str:
+    return w.lower()
+
+def tokenize_text(text: str) -> List[str]:
+    # translate + split stays in C; only non-ASCII text needs the regex
+    if not text.isascii():
+        return [normalize_word(m.group(0)) for m in TOKEN_RE.finditer(text)]
+    return text.translate(_NON_TOKEN).lower().split()
+
+def _decode_escape(m: re.Match[str]) -> str:
+    if m.group(1):
+        return chr(int(m.group(1), 16))
+    esc = m.group(2)
+    return _JSON_ESCAPES.get(esc, esc) if esc else ""
+
+def count_story_tokens(partial_json: str) -> int:
+    m = _STORY_TEXT_RE.search(partial_json)
+    if m is None:
+        return 0
+    # Decode escapes as the final JSON parse will, so the running count matches
+    # what validation counts; an escaped apostrophe (\u0027) joins a word
+    return len(tokenize_text(_JSON_ESCAPE_RE.sub(_decode_escape, m.group(1))))
+
+def split_sentences(text: str) -> List[str]:
+    parts = _SENT_RE.split(text.strip())
+    return [p for p in parts if p]
+
+def out_of_bank_words(level: str, text: str) -> List[str]:
+    mask: int = ALLOWED_MASK[level]
+    return sorted({t for t in tokenize_text(text) if not WORD_BIT.get(t, 0) & mask})
+
+# Pure, so memoized: retries and cache layers often re-validate the same text.
+# Arguments and results are tuples so they are hashable and safe to share.
+@functools.lru_cache(maxsize=1024)
+def check_story_text(level: str, story_text: str, used_words: Tuple[str, ...]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    # Returns (errors, sentences) for a story at the given level
+    errors: List[str] = []
+    mask: int = ALLOWED_MASK[level]
+
+    used: List[str] = [normalize_word(w) for w in used_words]
+
+    # Bitmask membership against the level's bank; each out-of-bank word is reported once
+    for w in sorted(w for w in set(used) if not WORD_BIT.get(w, 0) & mask):
+        errors.append(f"Out-of-bank used_words item: {w}")
+
+    # Single pass over the story: token count plus unique tokens in first-appearance order
+    n_tokens = 0
+    uniq: List[str] = []
+    seen: Set[str] = set()
+    for t in tokenize_text(story_text):
+        n_tokens += 1
+        if t not in seen:
+            uniq.append(t)
+            seen.add(t)
+
+    # tokens must all be in bank
+    for t in sorted(t for t in seen if not WORD_BIT.get(t, 0) & mask):
+        errors.append(f"OOV token in story_text: {t}")
+
+    # Difficulty caps
+    policy = LEVEL_POLICY[level]
+    if n_tokens > policy["max_tokens"]:
+        errors.append(f"Too many tokens: {n_tokens} > {policy['max_tokens']}")
+    sents = split_sentences(story_text)
+    if len(sents) > policy["max_sentences"]:
+        errors.append(f"Too many sentences: {len(sents)} > {policy['max_sentences']}")
+
+    # Ensure used_words reflects unique tokens in first-appearance order
+    if used != uniq:
+        errors.append("used_words does not match unique token order from story_text")
+
+    return tuple(errors), tuple(sents)
@@ -1,21 +1,40 @@
-from typing import Dict, Set, Literal
+import functools
+import operator
+from typing import Dict, FrozenSet, List, Literal
 
 LEVELS = list("ABCDEFGH")
 
 LevelEnum = Literal["A","B","C","D","E","F","G","H"]
 
-# Example word bank
-WORD_BANK: Dict[str, Set[str]] = {
-    "A": {"boy", "girl", "dog", "cat", "see", "run", "happy", "today"},
-    "B": {"boy", "girl", "dog", "cat", "see", "run", "happy", "today", "school", "friend"},
-    "C": {"boy", "girl", "dog", "cat", "see", "run", "happy", "today", "school", "friend", "house", "play"},
-    "D": {"boy", "girl", "dog", "cat", "see", "run", "happy", "today", "school", "friend", "house", "play", "yesterday", "park"},
-    "E": {"boy", "girl", "dog", "cat", "see", "run", "happy", "today", "school", "friend", "house", "play", "yesterday", "park", "finish", "want"},
-    "F": {"boy", "girl", "dog", "cat", "see", "run", "happy", "today", "school", "friend", "house", "play", "yesterday", "park", "finish", "want", "ask", "help"},
-    "G": {"boy", "girl", "dog", "cat", "see", "run", "happy", "today", "school", "friend", "house", "play", "yesterday", "park", "finish", "want", "ask", "help", "because"},
-    "H": {"boy", "girl", "dog", "cat", "see", "run", "happy", "today", "school", "friend", "house", "play", "yesterday", "park", "finish", "want", "ask", "help", "because", "before", "after"},
+# Example word bank. Each level adds to the one before it, so only the new
+# words are listed and WORD_BANK[level] is the running union.
+LEVEL_ADDS: Dict[str, FrozenSet[str]] = {
+    "A": frozenset({"boy", "girl", "dog", "cat", "see", "run", "happy", "today"}),
+    "B": frozenset({"school", "friend"}),
+    "C": frozenset({"house", "play"}),
+    "D": frozenset({"yesterday", "park"}),
+    "E": frozenset({"finish", "want"}),
+    "F": frozenset({"ask", "help"}),
+    "G": frozenset({"because"}),
+    "H": frozenset({"before", "after"}),
 }
 
+WORD_BANK: Dict[str, FrozenSet[str]] = {}
+_acc: FrozenSet[str] = frozenset()
+for _lvl in LEVELS:
+    _acc = _acc | LEVEL_ADDS[_lvl]
+    WORD_BANK[_lvl] = _acc
+
+# Bit index per word; each level's bank becomes a single integer mask, so
+# membership is WORD_BIT.get(word, 0) & ALLOWED_MASK[level]
+WORD_BIT: Dict[str, int] = {w: 1 << i for i, w in enumerate(sorted(frozenset().union(*WORD_BANK.values())))}
+ALLOWED_MASK: Dict[str, int] = {
+    lvl: functools.reduce(operator.or_, (WORD_BIT[w] for w in words), 0) for lvl, words in WORD_BANK.items()
+}
+
+# Sorted bullet list per level, built once so prompt prefixes stay byte-identical
+SORTED_BULLETS: Dict[str, str] = {lvl: "\n".join(sorted(words)) for lvl, words in WORD_BANK.items()}
+
 LEVEL_POLICY = {
     "A": {"max_tokens": 40, "max_sentences": 3},
     "B": {"max_tokens": 50, "max_sentences": 4},
@@ -26,3 +45,15 @@ LEVEL_POLICY = {
     "G": {"max_tokens": 100, "max_sentences": 7},
     "H": {"max_tokens": 110, "max_sentences": 7},
 }
+
+# LLM cascade: cheapest model first, escalating only once its retries are exhausted
+MODEL_LADDER: Dict[str, List[str]] = {
+    "A": ["gemini-2.0-flash-lite", "gemini-2.0-flash"],
+    "B": ["gemini-2.0-flash-lite", "gemini-2.0-flash"],
+    "C": ["gemini-2.0-flash-lite", "gemini-2.0-flash"],
+    "D": ["gemini-2.0-flash", "gemini-2.5-pro"],
+    "E": ["gemini-2.0-flash", "gemini-2.5-pro"],
+    "F": ["gemini-2.0-flash", "gemini-2.5-pro"],
+    "G": ["gemini-2.0-flash", "gemini-2.5-pro"],
+    "H": ["gemini-2.0-flash", "gemini-2.5-pro"],
+}
@@ -0,0 +1,17 @@
+import pytest
+
+
+class _Unscored:
+    dalechall_score = 0.0
+
+    def __init__(self, text: str) -> None:
+        pass
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    import generator
+
+    # The readability score is only printed, and scoring pulls in textatistic's dictionaries
+    monkeypatch.setattr(generator, "Textatistic", _Unscored)
+    return generator
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+
+BATCH_PLAN = '{"level": "A", "used_words": ["boy", "see", "dog", "run"], "story_text": "Boy see dog. Dog run."}'
+RETRIED_PLAN = '{"level": "A", "used_words": ["girl", "see", "cat"], "story_text": "Girl see cat."}'
+INVALID_PLAN = '{"level": "A", "used_words": ["zebra"], "story_text": "Zebra zebra zebra."}'
+
+TOPICS = [(f"topic {i}", "A") for i in range(8)]
+
+
+def _job(texts, state="JOB_STATE_SUCCEEDED"):
+    # None in texts stands for an errored item, which carries no response
+    dest = None if texts is None else SimpleNamespace(inlined_responses=[
+        SimpleNamespace(response=None if text is None else SimpleNamespace(text=text))
+        for text in texts
+    ])
+    return SimpleNamespace(name="batches/test", state=SimpleNamespace(name=state), dest=dest)
+
+
+@pytest.fixture
+def run_batch(generator, monkeypatch):
+    retried = []
+
+    async def fake_generate_stories(topics_levels, model=None):
+        retried.extend(topics_levels)
+        return [
+            RuntimeError(topic) if topic.startswith("unsatisfiable") else generator.StoryPlan.model_validate_json(RETRIED_PLAN)
+            for topic, _ in topics_levels
+        ]
+
+    monkeypatch.setattr(generator, "generate_stories", fake_generate_stories)
+
+    def run(topics_levels, job):
+        batches = SimpleNamespace(create=lambda model, src: job, get=lambda name: job)
+        monkeypatch.setattr(generator, "_client", SimpleNamespace(batches=batches))
+        return generator.generate_stories_batch(topics_levels, poll_seconds=0), retried
+
+    return run
+
+
+def _stories(results):
+    return [r.story_text if not isinstance(r, BaseException) else type(r) for r in results]
+
+
+def test_short_response_list_retries_unanswered_topics(run_batch):
+    results, retried = run_batch(TOPICS, _job([BATCH_PLAN] * 6))
+
+    assert retried == TOPICS[6:]
+    assert _stories(results) == ["Boy see dog. Dog run."] * 6 + ["Girl see cat."] * 2
+
+
+def test_failed_items_are_retried_in_place(run_batch):
+    topics = TOPICS[:4] + [("unsatisfiable topic", "A")] + TOPICS[5:]
+    job = _job([BATCH_PLAN, None, "", "not json", INVALID_PLAN, BATCH_PLAN, BATCH_PLAN, BATCH_PLAN])
+
+    results, retried = run_batch(topics, job)
+
+    assert retried == topics[1:5]
+    assert _stories(results) == (
+        ["Boy see dog. Dog run."] + ["Girl see cat."] * 3 + [RuntimeError] + ["Boy see dog. Dog run."] * 3
+    )
+
+
+@pytest.mark.parametrize("job", [
+    _job(None),
+    _job([BATCH_PLAN] * 8, state="JOB_STATE_FAILED"),
+], ids=["no-dest", "failed-job"])
+def test_job_without_results_retries_every_topic(run_batch, job):
+    results, retried = run_batch(TOPICS, job)
+
+    assert retried == TOPICS
+    assert _stories(results) == ["Girl see cat."] * 8
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from google.genai.errors import ServerError
+
+VALID_PLAN = '{"level": "A", "used_words": ["boy", "see", "dog", "run"], "story_text": "Boy see dog. Dog run."}'
+INVALID_PLAN = '{"level": "A", "used_words": ["zebra"], "story_text": "Zebra zebra zebra."}'
+
+
+def _unavailable():
+    return ServerError(503, {"error": {"code": 503, "message": "overloaded", "status": "UNAVAILABLE"}})
+
+
+@pytest.fixture
+def speculate(generator, monkeypatch):
+    low, high = generator.SPECULATIVE_TEMPERATURES
+
+    def run(low_outcome, high_outcome):
+        # The low-temperature candidate always finishes first
+        outcomes = {low: (0.0, low_outcome), high: (0.01, high_outcome)}
+
+        async def fake_stream(client, model, contents, config, max_tokens):
+            delay, outcome = outcomes[config.temperature]
+            await asyncio.sleep(delay)
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return outcome, True
+
+        monkeypatch.setattr(generator, "_stream_story_async", fake_stream)
+        tighten_msgs = []
+        result = asyncio.run(generator._speculate(None, "test-model", [], generator._GEN_CONFIG, "A", tighten_msgs))
+        return result, tighten_msgs
+
+    return run
+
+
+def test_error_then_valid_returns_the_valid_plan(speculate):
+    (text, plan, errors), tighten_msgs = speculate(_unavailable(), VALID_PLAN)
+
+    assert text == VALID_PLAN
+    assert plan is not None and plan.story_text == "Boy see dog. Dog run."
+    assert errors == [] and tighten_msgs == []
+
+
+def test_error_then_invalid_retries_from_the_invalid_candidate(speculate):
+    (text, plan, errors), tighten_msgs = speculate(_unavailable(), INVALID_PLAN)
+
+    assert text == INVALID_PLAN
+    assert plan is None
+    assert errors
+    assert len(tighten_msgs) == 1
+
+
+def test_all_candidates_erroring_raises_the_first_error(speculate):
+    first, second = _unavailable(), _unavailable()
+
+    with pytest.raises(ServerError) as excinfo:
+        speculate(first, second)
+
+    assert excinfo.value is first
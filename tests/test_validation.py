@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from validation import check_story_text, count_story_tokens, tokenize_text
+from wordBank import LEVEL_POLICY
+
+MAX_TOKENS = LEVEL_POLICY["A"]["max_tokens"]
+
+# Every kind of escape a streamed response carries: quotes, control
+# characters, backslashes, and an apostrophe that encoders may send as '
+ESCAPED_STORY = 'Boy\'s dog run. Girl see "cat".\nHappy\ttoday, boy\\girl.'
+
+
+def _stream_json(story_text: str) -> str:
+    raw = json.dumps({"level": "A", "used_words": [], "story_text": story_text})
+    return raw.replace("'", "\\u0027")
+
+
+def _too_many_tokens(story_text: str) -> bool:
+    errors, _ = check_story_text("A", story_text, ())
+    return any(e.startswith("Too many tokens") for e in errors)
+
+
+@pytest.mark.parametrize("story_text", [
+    ESCAPED_STORY,
+    "boy don't run",
+    "café dog",
+    "dog été cat",
+])
+def test_count_matches_decoded_story(story_text):
+    assert count_story_tokens(_stream_json(story_text)) == len(tokenize_text(story_text))
+
+
+@pytest.mark.parametrize("extra", [-1, 0, 1])
+def test_stream_aborts_only_when_validation_would_fail(extra):
+    padding = MAX_TOKENS - len(tokenize_text(ESCAPED_STORY)) + extra
+    story_text = ESCAPED_STORY + " run" * padding
+    raw = _stream_json(story_text)
+
+    final = count_story_tokens(raw)
+    assert (final > MAX_TOKENS) == _too_many_tokens(story_text)
+    # The running count never overshoots while the response is still arriving
+    assert all(count_story_tokens(raw[:k]) <= final for k in range(len(raw)))
+
+
+def test_truncated_unicode_escape_is_not_counted():
+    assert count_story_tokens('{"story_text": "boy don\\u00') == 2
+    assert count_story_tokens('{"story_text": "boy don\\u0027t') == 2